@@ -1,7 +1,7 @@
 # The COPYRIGHT file at the top level of this repository contains the full
 # copyright notices and license terms.
 from trytond.pool import Pool
-from . import invoice
+from . import invoice, revaluation
 
 
 
@@ -10,4 +10,6 @@ def register():
         invoice.Invoice,
         invoice.InvoiceTax,
         invoice.InvoiceLine,
+        revaluation.InvoiceRevaluationContext,
+        revaluation.InvoiceRevaluation,
         module='account_invoice_company_currency', type_='model')
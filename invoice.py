@@ -3,6 +3,11 @@
 from collections import defaultdict
 from decimal import Decimal
 from itertools import groupby
+from operator import attrgetter, itemgetter
+
+from sql import Column, Null
+from sql.functions import CurrentTimestamp
+from sql.operators import Or
 
 from trytond.model import fields
 from trytond.pool import Pool, PoolMeta
@@ -10,6 +15,53 @@ from trytond.pyson import Eval
 from trytond.transaction import Transaction
 from trytond.modules.currency.fields import Monetary
 
+_INVOICE_CACHE_DEFAULT = dict.fromkeys([
+        'company_untaxed_amount_cache',
+        'company_tax_amount_cache',
+        'company_total_amount_cache',
+        ])
+_INVOICE_TAX_CACHE_DEFAULT = dict.fromkeys([
+        'company_base_cache',
+        'company_amount_cache',
+        ])
+_INVOICE_LINE_CACHE_DEFAULT = dict.fromkeys([
+        'company_amount_cache',
+        ])
+
+
+def _update_cache(Model, fnames, values):
+    """Store cache values of Model with conditional UPDATEs
+
+    values is a list of (id, [value per field]) and rows are only updated
+    when any of the cached columns is NULL or differs, so replaying the same
+    update is a no-op. Rows are updated by ascending id.
+    The ORM write is bypassed because it can not express this condition and
+    would run the write checks once per distinct value. write_uid and
+    write_date are still maintained but the on write triggers are not run.
+    Return the number of updated rows.
+    """
+    transaction = Transaction()
+    cursor = transaction.connection.cursor()
+    table = Model.__table__()
+    columns = [Column(table, n) for n in fnames]
+    count = 0
+    for id_, row in sorted(values, key=itemgetter(0)):
+        changed = []
+        for column, value in zip(columns, row):
+            if value is None:
+                changed.append(column != Null)
+            else:
+                changed.append((column == Null) | (column != value))
+        cursor.execute(*table.update(
+                columns + [table.write_uid, table.write_date],
+                row + [transaction.user, CurrentTimestamp()],
+                where=(table.id == id_) & Or(changed)))
+        count += max(cursor.rowcount, 0)
+    if count:
+        # Invalidate the records cached in the transaction
+        transaction.counter += 1
+    return count
+
 
 class Invoice(metaclass=PoolMeta):
     __name__ = 'account.invoice'
@@ -195,12 +247,7 @@ class Invoice(metaclass=PoolMeta):
         InvoiceLine = pool.get('account.invoice.line')
         InvoiceTax = pool.get('account.invoice.tax')
 
-        to_write = [invoices, {
-                'company_untaxed_amount_cache': None,
-                'company_tax_amount_cache': None,
-                'company_total_amount_cache': None,
-                }]
-        cls.write(*to_write)
+        cls.write(invoices, dict(_INVOICE_CACHE_DEFAULT))
 
         line_to_write = []
         tax_to_write = []
@@ -210,22 +257,13 @@ class Invoice(metaclass=PoolMeta):
 
         super().draft(invoices)
 
-        InvoiceLine.write(line_to_write, {
-            'company_amount_cache': None,
-            })
-        InvoiceTax.write(tax_to_write, {
-            'company_base_cache': None,
-            'company_amount_cache': None,
-            })
+        InvoiceLine.write(line_to_write, dict(_INVOICE_LINE_CACHE_DEFAULT))
+        InvoiceTax.write(tax_to_write, dict(_INVOICE_TAX_CACHE_DEFAULT))
 
     @classmethod
     def copy(cls, invoices, default=None):
-        if default is None:
-            default = {}
-        default = default.copy()
-        default['company_untaxed_amount_cache'] = None
-        default['company_tax_amount_cache'] = None
-        default['company_total_amount_cache'] = None
+        default = default.copy() if default is not None else {}
+        default.update(_INVOICE_CACHE_DEFAULT)
         return super().copy(invoices, default=default)
 
     @classmethod
@@ -234,35 +272,37 @@ class Invoice(metaclass=PoolMeta):
         InvoiceLine = pool.get('account.invoice.line')
         InvoiceTax = pool.get('account.invoice.tax')
 
-        line_to_write = []
-        tax_to_write = []
+        invoices = sorted(invoices, key=attrgetter('id'))
+        line_values = []
+        tax_values = []
         for invoice in invoices:
-            if (invoice.company_untaxed_amount == invoice.company_untaxed_amount_cache
-                    and invoice.company_tax_amount == invoice.company_tax_amount_cache
-                    and invoice.company_total_amount == invoice.company_total_amount_cache):
-                continue
-            invoice.company_untaxed_amount_cache = invoice.company_untaxed_amount
-            invoice.company_tax_amount_cache = invoice.company_tax_amount
-            invoice.company_total_amount_cache = invoice.company_total_amount
-
+            if (invoice.company_untaxed_amount != invoice.company_untaxed_amount_cache
+                    or invoice.company_tax_amount != invoice.company_tax_amount_cache
+                    or invoice.company_total_amount != invoice.company_total_amount_cache):
+                invoice.company_untaxed_amount_cache = invoice.company_untaxed_amount
+                invoice.company_tax_amount_cache = invoice.company_tax_amount
+                invoice.company_total_amount_cache = invoice.company_total_amount
+
+            # The values are computed without the caches and the unchanged
+            # ones are skipped by _update_cache
             for line in invoice.lines:
-                line_to_write.extend(([line], {
-                    'company_amount_cache': line.company_amount,
-                    }))
-
-            for line in invoice.taxes:
-                tax_to_write.extend(([line], {
-                    'company_base_cache': line.company_base,
-                    'company_amount_cache': line.company_amount,
-                    }))
-
+                line_values.append(
+                    (line.id, [line._compute_company_amount()]))
+            for tax in invoice.taxes:
+                tax_values.append((tax.id, [
+                            tax._compute_company_amount('company_base'),
+                            tax._compute_company_amount('company_amount'),
+                            ]))
+
+        # Sort the invoices so the base method processes them in a stable
+        # order. The row lock order of its grouped UPDATE is still decided
+        # by the query plan. The lines and taxes are updated afterwards one
+        # by one in ascending id order.
         super()._store_cache(invoices)
 
-        if line_to_write:
-            InvoiceLine.write(*line_to_write)
-
-        if tax_to_write:
-            InvoiceTax.write(*tax_to_write)
+        _update_cache(InvoiceLine, ['company_amount_cache'], line_values)
+        _update_cache(InvoiceTax,
+            ['company_base_cache', 'company_amount_cache'], tax_values)
 
 
 class InvoiceTax(metaclass=PoolMeta):
@@ -288,11 +328,8 @@ class InvoiceTax(metaclass=PoolMeta):
 
     @classmethod
     def copy(cls, taxes, default=None):
-        if default is None:
-            default = {}
-        default = default.copy()
-        default['company_base_cache'] = None
-        default['company_amount_cache'] = None
+        default = default.copy() if default is not None else {}
+        default.update(_INVOICE_TAX_CACHE_DEFAULT)
         return super().copy(taxes, default=default)
 
     @fields.depends('invoice', '_parent_invoice.company')
@@ -302,22 +339,23 @@ class InvoiceTax(metaclass=PoolMeta):
 
     @classmethod
     def get_amount(cls, invoice_taxes, names):
-        pool = Pool()
-        Currency = pool.get('currency.currency')
-
         result = {}
         for invoice_tax in invoice_taxes:
             for fname in names:
                 value = getattr(invoice_tax, '%s_cache' % fname)
                 if value is None:
-                    with Transaction().set_context(
-                            date=invoice_tax.invoice.currency_date):
-                        value = Currency.compute(invoice_tax.invoice.currency,
-                            getattr(invoice_tax, fname[8:]),
-                            invoice_tax.invoice.company.currency, round=True)
+                    value = invoice_tax._compute_company_amount(fname)
                 result.setdefault(fname, {})[invoice_tax.id] = value
         return result
 
+    def _compute_company_amount(self, fname):
+        "Return the value of fname computed without the cache"
+        Currency = Pool().get('currency.currency')
+        with Transaction().set_context(date=self.invoice.currency_date):
+            return Currency.compute(self.invoice.currency,
+                getattr(self, fname[8:]), self.invoice.company.currency,
+                round=True)
+
 
 class InvoiceLine(metaclass=PoolMeta):
     __name__ = 'account.invoice.line'
@@ -338,10 +376,8 @@ class InvoiceLine(metaclass=PoolMeta):
 
     @classmethod
     def copy(cls, lines, default=None):
-        if default is None:
-            default = {}
-        default = default.copy()
-        default['company_amount_cache'] = None
+        default = default.copy() if default is not None else {}
+        default.update(_INVOICE_LINE_CACHE_DEFAULT)
         return super().copy(lines, default=default)
 
     @fields.depends('invoice', 'currency', '_parent_invoice.company')
@@ -352,6 +388,16 @@ class InvoiceLine(metaclass=PoolMeta):
             return self.currency.id
 
     def get_company_amount(self, name=None):
+        currency = self.invoice and self.invoice.currency or self.currency
+        company = self.invoice and self.invoice.company or self.company
+
+        if (currency != company.currency
+                and self.company_amount_cache is not None):
+            return self.company_amount_cache
+        return self._compute_company_amount()
+
+    def _compute_company_amount(self):
+        "Return the company amount computed without the cache"
         pool = Pool()
         Date = pool.get('ir.date')
         Currency = pool.get('currency.currency')
@@ -363,9 +409,6 @@ class InvoiceLine(metaclass=PoolMeta):
         if currency == company.currency:
             return self.amount
 
-        if self.company_amount_cache is not None:
-            return self.company_amount_cache
-
         with Transaction().set_context(date=currency_date):
             return Currency.compute(currency, self.amount, company.currency,
                 round=True)
@@ -0,0 +1,217 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+from sql import Literal, Null, Union
+from sql.aggregate import Sum
+from sql.conditionals import Case, Coalesce
+from sql.functions import CurrentTimestamp
+
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.pyson import Eval
+from trytond.transaction import Transaction
+from trytond.modules.currency.fields import Monetary
+
+
+class InvoiceRevaluationContext(ModelView):
+    'Invoice Revaluation Context'
+    __name__ = 'account.invoice.revaluation.context'
+    company = fields.Many2One('company.company', 'Company', required=True,
+        domain=[
+            ('id', 'in', Eval('context', {}).get('companies', [])),
+            ])
+    date = fields.Date('Date', required=True)
+
+    @classmethod
+    def default_company(cls):
+        return Transaction().context.get('company')
+
+    @classmethod
+    def default_date(cls):
+        return Pool().get('ir.date').today()
+
+
+class InvoiceRevaluation(ModelSQL, ModelView):
+    'Invoice Revaluation'
+    __name__ = 'account.invoice.revaluation'
+    invoice = fields.Many2One('account.invoice', 'Invoice')
+    company = fields.Many2One('company.company', 'Company')
+    party = fields.Many2One('party.party', 'Party')
+    type = fields.Selection([
+            ('out', "Customer"),
+            ('in', "Supplier"),
+            ], 'Type')
+    currency = fields.Many2One('currency.currency', 'Currency')
+    company_currency = fields.Function(
+        fields.Many2One('currency.currency', 'Company Currency'),
+        'get_company_currency')
+    invoice_currency_amount = Monetary('Amount in Invoice Currency',
+        digits='currency', currency='currency',
+        help="The amount to pay of the lines in the invoice currency.")
+    other_company_amount = Monetary(
+        'Amount in Other Currencies (Company Currency)',
+        digits='company_currency', currency='company_currency',
+        help="The amount to pay of the lines not in the invoice currency.")
+    currency_date = fields.Date('Currency Date')
+    amount = fields.Function(Monetary('Amount to Pay',
+            digits='currency', currency='currency',
+            help="The amount to pay including the lines in other currencies "
+            "converted at the currency date of the invoice."),
+        'get_amounts')
+    company_amount = Monetary('Amount to Pay (Company Currency)',
+        digits='company_currency', currency='company_currency',
+        help="The amount to pay at the posting rate.")
+    closing_company_amount = fields.Function(
+        Monetary('Amount to Pay at Closing Rate (Company Currency)',
+            digits='company_currency', currency='company_currency',
+            help="The amount to pay at the rate of the date."),
+        'get_amounts')
+    revaluation = fields.Function(Monetary('Revaluation',
+            digits='company_currency', currency='company_currency',
+            help="The difference between the closing and the posting amounts."),
+        'get_amounts')
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls._order.insert(0, ('invoice', 'ASC'))
+
+    @classmethod
+    def table_query(cls):
+        pool = Pool()
+        Company = pool.get('company.company')
+        Date = pool.get('ir.date')
+        Invoice = pool.get('account.invoice')
+        Line = pool.get('account.move.line')
+        Move = pool.get('account.move')
+        Reconciliation = pool.get('account.move.reconciliation')
+        InvoicePayment = pool.get(Invoice.payment_lines.relation_name)
+
+        company = Company.__table__()
+        invoice = Invoice.__table__()
+        line = Line.__table__()
+        move = Move.__table__()
+        reconciliation = Reconciliation.__table__()
+        invoice_payment = InvoicePayment.__table__()
+
+        context = Transaction().context
+        date = context.get('date') or Date.today()
+
+        # The lines to pay and the payment lines of each invoice
+        invoice_line = Union(
+            invoice.join(line,
+                condition=(line.move == invoice.move)
+                & (line.account == invoice.account)
+                ).select(
+                invoice.id.as_('invoice'), line.id.as_('line')),
+            invoice_payment.select(
+                invoice_payment.invoice.as_('invoice'),
+                invoice_payment.line.as_('line')),
+            all_=True)
+
+        sign = Case((invoice.type == 'in', -1), else_=1)
+        in_currency = line.second_currency == invoice.currency
+        return (invoice_line
+            .join(invoice, condition=invoice_line.invoice == invoice.id)
+            .join(company, condition=invoice.company == company.id)
+            .join(line, condition=invoice_line.line == line.id)
+            .join(move, condition=line.move == move.id)
+            .join(reconciliation, 'LEFT',
+                condition=line.reconciliation == reconciliation.id)
+            .select(
+                invoice.id.as_('id'),
+                Literal(0).as_('create_uid'),
+                CurrentTimestamp().as_('create_date'),
+                cls.write_uid.sql_cast(Literal(Null)).as_('write_uid'),
+                cls.write_date.sql_cast(Literal(Null)).as_('write_date'),
+                invoice.id.as_('invoice'),
+                invoice.company.as_('company'),
+                invoice.party.as_('party'),
+                invoice.type.as_('type'),
+                invoice.currency.as_('currency'),
+                Coalesce(invoice.accounting_date, invoice.invoice_date
+                    ).as_('currency_date'),
+                cls.invoice_currency_amount.sql_cast(
+                    Sum(sign * Case(
+                            (in_currency, line.amount_second_currency),
+                            else_=0))).as_('invoice_currency_amount'),
+                cls.other_company_amount.sql_cast(
+                    Sum(sign * Case(
+                            (in_currency, 0),
+                            else_=line.debit - line.credit))
+                    ).as_('other_company_amount'),
+                cls.company_amount.sql_cast(
+                    Sum(sign * (line.debit - line.credit))
+                    ).as_('company_amount'),
+                where=(invoice.company == context.get('company', -1))
+                & invoice.state.in_(['posted', 'paid'])
+                & (invoice.currency != company.currency)
+                & (move.date <= date)
+                & ((line.reconciliation == Null)
+                    | (reconciliation.date > date)),
+                group_by=[
+                    invoice.id, invoice.company, invoice.party, invoice.type,
+                    invoice.currency, invoice.accounting_date,
+                    invoice.invoice_date]))
+
+    def get_company_currency(self, name):
+        return self.company.currency.id
+
+    @classmethod
+    def _get_rates(cls, currency_ids, dates):
+        "Return the rates by currency id and date"
+        Currency = Pool().get('currency.currency')
+        rates = {}
+        for date in dates:
+            with Transaction().set_context(date=date):
+                for currency in Currency.browse(currency_ids):
+                    rates[currency.id, date] = currency.rate
+        return rates
+
+    @classmethod
+    def get_amounts(cls, records, names):
+        pool = Pool()
+        Date = pool.get('ir.date')
+
+        date = Transaction().context.get('date') or Date.today()
+
+        currency_ids = set()
+        for record in records:
+            currency_ids.add(record.currency.id)
+            currency_ids.add(record.company.currency.id)
+        dates = {date} | {r.currency_date for r in records}
+        # Fetch the rate of each currency only once per date
+        rates = cls._get_rates(list(currency_ids), dates)
+
+        def convert(amount, from_currency, to_currency, date):
+            from_rate = rates[from_currency.id, date]
+            to_rate = rates[to_currency.id, date]
+            if amount is None or not from_rate or not to_rate:
+                return None
+            return to_currency.round(amount * to_rate / from_rate)
+
+        result = {name: {} for name in names}
+        for record in records:
+            # Like Invoice.get_amount_to_pay, the lines not in the invoice
+            # currency are converted as a whole at the invoice currency date
+            amount = record.invoice_currency_amount
+            if record.other_company_amount:
+                other_amount = convert(record.other_company_amount,
+                    record.company.currency, record.currency,
+                    record.currency_date)
+                if other_amount is None:
+                    amount = None
+                else:
+                    amount += other_amount
+            closing_amount = convert(amount, record.currency,
+                record.company.currency, date)
+            if 'amount' in names:
+                result['amount'][record.id] = amount
+            if 'closing_company_amount' in names:
+                result['closing_company_amount'][record.id] = closing_amount
+            if 'revaluation' in names:
+                if closing_amount is not None:
+                    result['revaluation'][record.id] = (
+                        closing_amount - record.company_amount)
+                else:
+                    result['revaluation'][record.id] = None
+        return result
@@ -0,0 +1,45 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+"""Benchmark the copy of invoices with many lines
+
+Run with:
+
+    python -m trytond.modules.account_invoice_company_currency.tests.benchmark_copy
+
+The time per line must stay stable when the number of lines grows.
+"""
+import time
+from decimal import Decimal
+
+from trytond.modules.company.tests import create_company, set_company
+from trytond.modules.currency.tests import add_currency_rate, create_currency
+from trytond.pool import Pool
+from trytond.tests.test_tryton import DB_NAME, USER, activate_module
+from trytond.transaction import Transaction
+
+from .test_module import create_invoices
+
+SIZES = [250, 500, 1000, 2000]
+
+
+def main():
+    activate_module('account_invoice_company_currency')
+    with Transaction().start(DB_NAME, USER) as transaction:
+        Invoice = Pool().get('account.invoice')
+        eur = create_currency('EUR')
+        add_currency_rate(eur, Decimal(2))
+        print("%6s %10s %12s" % ("lines", "seconds", "ms per line"))
+        for size in SIZES:
+            company = create_company()
+            with set_company(company):
+                invoice, = create_invoices(company, eur, lines=size)
+                start = time.perf_counter()
+                Invoice.copy([invoice])
+                duration = time.perf_counter() - start
+            print("%6d %10.3f %12.3f" % (
+                    size, duration, duration * 1000 / size))
+        transaction.rollback()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+"""Benchmark the pool initialization with the module activated
+
+Run with:
+
+    python -m trytond.modules.account_invoice_company_currency.tests.benchmark_pool_init
+
+DB_NAME must point to a persistent database (not :memory:) as the pool is
+stopped between runs. It prints the mean duration of a pool initialization,
+the time spent in the code of this module and the profile of its functions
+which includes the time of the super calls.
+"""
+import cProfile
+import os
+import pstats
+import sys
+import time
+
+from trytond.pool import Pool
+from trytond.tests.test_tryton import DB_NAME, activate_module
+
+RUNS = 5
+MODULE = 'account_invoice_company_currency'
+
+
+def init():
+    Pool.stop(DB_NAME)
+    Pool(DB_NAME).init()
+
+
+def main():
+    if DB_NAME == ':memory:':
+        sys.exit("DB_NAME must be a persistent database, not :memory:, "
+            "as the pool is stopped between runs")
+    activate_module(MODULE)
+
+    durations = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        init()
+        durations.append(time.perf_counter() - start)
+    print("Pool init: %.3fs (mean of %d runs)" % (
+            sum(durations) / len(durations), RUNS))
+
+    profile = cProfile.Profile()
+    profile.runcall(init)
+    stats = pstats.Stats(profile)
+    module_path = os.path.dirname(os.path.dirname(__file__))
+    total = sum(tt for _, _, tt, _, _ in stats.stats.values())
+    own = sum(tt for (filename, _, _), (_, _, tt, _, _)
+        in stats.stats.items() if filename.startswith(module_path))
+    print("Time in %s: %.4fs of %.3fs" % (MODULE, own, total))
+    stats.sort_stats('cumulative').print_stats(module_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+"""Benchmark the invoice revaluation report on many open invoices
+
+Run with:
+
+    python -m trytond.modules.account_invoice_company_currency.tests.benchmark_revaluation [COUNT]
+
+COUNT is the number of open invoices (default 10000). Only the search and
+the read of the report are timed, the creation and the posting of the
+invoices are not.
+"""
+import datetime
+import sys
+import time
+from decimal import Decimal
+
+from trytond.modules.company.tests import create_company, set_company
+from trytond.modules.currency.tests import add_currency_rate, create_currency
+from trytond.pool import Pool
+from trytond.tests.test_tryton import DB_NAME, USER, activate_module
+from trytond.transaction import Transaction
+
+from .test_module import create_invoices
+
+FIELDS = ['invoice', 'amount', 'company_amount', 'closing_company_amount',
+    'revaluation']
+
+
+def main(count):
+    activate_module('account_invoice_company_currency')
+    with Transaction().start(DB_NAME, USER) as transaction:
+        pool = Pool()
+        Invoice = pool.get('account.invoice')
+        Revaluation = pool.get('account.invoice.revaluation')
+
+        company = create_company()
+        with set_company(company):
+            eur = create_currency('EUR')
+            add_currency_rate(eur, Decimal(2))
+            invoices = create_invoices(company, eur, count=count)
+            Invoice.post(invoices)
+            closing_date = datetime.date.today()
+            add_currency_rate(eur, Decimal(4), date=closing_date)
+
+            with Transaction().set_context(date=closing_date):
+                start = time.perf_counter()
+                revaluations = Revaluation.search([])
+                Revaluation.read([r.id for r in revaluations], FIELDS)
+                duration = time.perf_counter() - start
+        print("%d open invoices revaluated in %.3fs" % (
+                len(revaluations), duration))
+        transaction.rollback()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
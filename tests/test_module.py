@@ -1,14 +1,219 @@
-
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
+import random
+import threading
+import time
+import unittest
+from decimal import Decimal
+
+from trytond import backend
+from trytond.modules.account.tests import create_chart, get_fiscalyear
+from trytond.modules.account_invoice.tests import set_invoice_sequences
+from trytond.modules.company.tests import (
+    CompanyTestMixin, create_company, set_company)
+from trytond.modules.currency.tests import add_currency_rate, create_currency
+from trytond.pool import Pool
+from trytond.tests.test_tryton import (
+    DB_NAME, USER, ModuleTestCase, activate_module, drop_db, with_transaction)
+from trytond.transaction import Transaction
+
+from ..invoice import _update_cache
+
 
-from trytond.modules.company.tests import CompanyTestMixin
-from trytond.tests.test_tryton import ModuleTestCase
+def create_invoices(company, currency, count=1, lines=1):
+    "Create draft customer invoices in currency"
+    pool = Pool()
+    Account = pool.get('account.account')
+    FiscalYear = pool.get('account.fiscalyear')
+    Invoice = pool.get('account.invoice')
+    Journal = pool.get('account.journal')
+    Party = pool.get('party.party')
+
+    create_chart(company)
+    fiscalyear = set_invoice_sequences(get_fiscalyear(company))
+    fiscalyear.save()
+    FiscalYear.create_period([fiscalyear])
+    receivable, = Account.search([
+            ('type.receivable', '=', True),
+            ('closed', '!=', True),
+            ('company', '=', company.id),
+            ], limit=1)
+    revenue, = Account.search([
+            ('type.revenue', '=', True),
+            ('closed', '!=', True),
+            ('company', '=', company.id),
+            ], limit=1)
+    journal, = Journal.search([('type', '=', 'revenue')], limit=1)
+    party, = Party.create([{
+                'name': "Party",
+                'addresses': [('create', [{}])],
+                }])
+
+    return Invoice.create([{
+                'type': 'out',
+                'company': company.id,
+                'currency': currency.id,
+                'party': party.id,
+                'invoice_address': party.addresses[0].id,
+                'account': receivable.id,
+                'journal': journal.id,
+                'invoice_date': fiscalyear.start_date,
+                'lines': [('create', [{
+                                'company': company.id,
+                                'currency': currency.id,
+                                'account': revenue.id,
+                                'description': "Line %s" % i,
+                                'quantity': 1,
+                                'unit_price': Decimal(10 + i),
+                                } for i in range(lines)])],
+                } for _ in range(count)])
 
 
 class AccountInvoiceCompanyCurrencyTestCase(CompanyTestMixin, ModuleTestCase):
     'Test AccountInvoiceCompanyCurrency module'
     module = 'account_invoice_company_currency'
 
+    @with_transaction()
+    def test_store_cache(self):
+        "Test store cache updates only NULL or differing values"
+        pool = Pool()
+        Invoice = pool.get('account.invoice')
+        InvoiceLine = pool.get('account.invoice.line')
+
+        company = create_company()
+        with set_company(company):
+            eur = create_currency('EUR')
+            add_currency_rate(eur, Decimal(2))
+            invoice, = create_invoices(company, eur, lines=2)
+            Invoice.post([invoice])
+
+            invoice = Invoice(invoice.id)
+            self.assertEqual(invoice.company_untaxed_amount_cache,
+                Decimal('10.50'))
+            self.assertEqual(
+                sorted(l.company_amount_cache for l in invoice.lines),
+                [Decimal('5.00'), Decimal('5.50')])
+
+            # Replaying stores nothing
+            line_values = [(l.id, [l.company_amount_cache])
+                for l in invoice.lines]
+            self.assertEqual(_update_cache(
+                    InvoiceLine, ['company_amount_cache'], line_values), 0)
+
+            # NULL and differing line caches are updated even when the
+            # invoice caches match
+            line1, line2 = sorted(invoice.lines, key=lambda l: l.id)
+            InvoiceLine.write([line1], {'company_amount_cache': None})
+            InvoiceLine.write([line2], {'company_amount_cache': Decimal(1)})
+            Invoice._store_cache([Invoice(invoice.id)])
+
+            line1, line2 = InvoiceLine.browse([line1.id, line2.id])
+            self.assertEqual(line1.company_amount_cache, Decimal('5.00'))
+            self.assertEqual(line2.company_amount_cache, Decimal('5.50'))
+
+            # NULL invoice caches are updated
+            Invoice.write([invoice], {'company_untaxed_amount_cache': None})
+            Invoice._store_cache([Invoice(invoice.id)])
+
+            invoice = Invoice(invoice.id)
+            self.assertEqual(invoice.company_untaxed_amount_cache,
+                Decimal('10.50'))
+
+
+@unittest.skipUnless(backend.name == 'postgresql',
+    "Concurrent connections require PostgreSQL")
+class AccountInvoiceCompanyCurrencyConcurrencyTestCase(unittest.TestCase):
+    'Test AccountInvoiceCompanyCurrency concurrent posting'
+    workers = 4
+    invoices = 40
+    retry = 20
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        activate_module('account_invoice_company_currency')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        drop_db()
+
+    def run_workers(self, function, context):
+        "Run function in a transaction per worker and return the errors"
+        errors = []
+        barrier = threading.Barrier(self.workers)
+
+        def worker(index):
+            barrier.wait()
+            for count in range(self.retry, -1, -1):
+                try:
+                    with Transaction().start(DB_NAME, USER,
+                            context=context) as transaction:
+                        function(index)
+                        transaction.commit()
+                    break
+                except backend.DatabaseOperationalError as exception:
+                    # Operational errors like serialization failures or
+                    # NOWAIT locks are retried as the dispatcher does but
+                    # deadlocks are reported
+                    if (getattr(exception, 'pgcode', None) == '40P01'
+                            or not count):
+                        errors.append(exception)
+                        break
+                    time.sleep(random.random() * 0.1)
+                except Exception as exception:
+                    errors.append(exception)
+                    break
+
+        threads = [threading.Thread(target=worker, args=(i,))
+            for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def test_concurrent_post(self):
+        "Test posting invoices from concurrent connections"
+        with Transaction().start(DB_NAME, USER) as transaction:
+            company = create_company()
+            with set_company(company):
+                eur = create_currency('EUR')
+                add_currency_rate(eur, Decimal(2))
+                invoice_ids = [i.id for i in create_invoices(
+                        company, eur, count=self.invoices, lines=5)]
+            company_id = company.id
+            transaction.commit()
+        context = {'company': company_id}
+
+        def post(index):
+            Invoice = Pool().get('account.invoice')
+            ids = invoice_ids[index::self.workers]
+            Invoice.post(Invoice.browse(list(reversed(ids))))
+
+        def store_cache(index):
+            Invoice = Pool().get('account.invoice')
+            ids = list(invoice_ids)
+            random.shuffle(ids)
+            Invoice.write(Invoice.browse(ids), {
+                    'company_untaxed_amount_cache': None,
+                    })
+            Invoice._store_cache(Invoice.browse(ids))
+
+        self.assertEqual(self.run_workers(post, context), [])
+        self.assertEqual(self.run_workers(store_cache, context), [])
+
+        with Transaction().start(DB_NAME, USER, context=context):
+            Invoice = Pool().get('account.invoice')
+            for invoice in Invoice.browse(invoice_ids):
+                self.assertEqual(invoice.state, 'posted')
+                self.assertEqual(invoice.company_untaxed_amount_cache,
+                    Decimal('30.00'))
+                self.assertEqual(invoice.company_total_amount_cache,
+                    Decimal('30.00'))
+                self.assertEqual(
+                    [l.company_amount_cache for l in invoice.lines],
+                    [l.company_amount for l in invoice.lines])
+
 
 del ModuleTestCase
@@ -230,3 +230,95 @@ class Test(unittest.TestCase):
         self.assertEqual(invoice.company_total_amount_cache, None)
         self.assertEqual([(t.company_base_cache, t.company_amount_cache) for t in invoice.taxes], [(None, None)])
         self.assertEqual([t.company_amount_cache for t in invoice.lines], [None, None])
+
+        # Post several invoices at once
+        invoices = []
+        for quantity in range(1, 6):
+            invoice = Invoice(type='out')
+            invoice.party = party
+            invoice.payment_term = payment_term
+            invoice.currency = eur
+            line = invoice.lines.new()
+            line.product = product
+            line.quantity = quantity
+            line.unit_price = Decimal('40.00')
+            invoice.save()
+            invoices.append(invoice)
+        Invoice.click(invoices, 'post')
+        for quantity, invoice in enumerate(invoices, 1):
+            invoice.reload()
+            self.assertEqual(invoice.state, 'posted')
+            self.assertEqual(invoice.company_untaxed_amount_cache,
+                Decimal('20.00') * quantity)
+            self.assertEqual(invoice.company_tax_amount_cache,
+                Decimal('2.00') * quantity)
+            self.assertEqual(invoice.company_total_amount_cache,
+                Decimal('22.00') * quantity)
+            self.assertEqual([t.company_amount_cache for t in invoice.lines],
+                [Decimal('20.00') * quantity])
+            self.assertEqual(
+                [(t.company_base_cache, t.company_amount_cache)
+                    for t in invoice.taxes],
+                [(Decimal('20.00') * quantity, Decimal('2.00') * quantity)])
+
+        # Pay partially in company currency at another rate than the invoice
+        CurrencyRate = Model.get('currency.currency.rate')
+        payment_date = period.end_date
+        CurrencyRate(currency=eur, date=payment_date,
+            rate=Decimal('2.5')).save()
+        paid_invoice = Invoice(type='out')
+        paid_invoice.party = party
+        paid_invoice.currency = eur
+        paid_invoice.invoice_date = period.start_date
+        line = paid_invoice.lines.new()
+        line.account = revenue
+        line.description = 'Test'
+        line.quantity = 1
+        line.unit_price = Decimal('200.00')
+        paid_invoice.click('post')
+        self.assertEqual(paid_invoice.state, 'posted')
+
+        Journal = Model.get('account.journal')
+        Move = Model.get('account.move')
+        MoveLine = Model.get('account.move.line')
+        journal_cash, = Journal.find([('type', '=', 'cash')], limit=1)
+        move = Move(period=period, journal=journal_cash, date=payment_date)
+        move.lines.new(account=accounts['cash'], debit=Decimal('50.00'))
+        move.lines.new(account=paid_invoice.account, party=party,
+            credit=Decimal('50.00'))
+        move.click('post')
+        payment_line, = [l for l in move.lines
+            if l.account == paid_invoice.account]
+        self.assertEqual(payment_line.second_currency, None)
+        paid_invoice.payment_lines.append(MoveLine(payment_line.id))
+        paid_invoice.save()
+        paid_invoice.reload()
+        self.assertEqual(paid_invoice.amount_to_pay, Decimal('100.00'))
+
+        # Revaluate open invoices at a new rate
+        closing_date = payment_date + relativedelta(days=1)
+        CurrencyRate(currency=eur, date=closing_date, rate=Decimal('4')).save()
+        Revaluation = Model.get('account.invoice.revaluation')
+        with config.set_context(company=company.id, date=closing_date):
+            revaluations = Revaluation.find([])
+        self.assertEqual(len(revaluations), 7)
+        revaluation = revaluations[0]
+        self.assertEqual(revaluation.amount, Decimal('240.00'))
+        self.assertEqual(revaluation.company_amount, Decimal('120.00'))
+        self.assertEqual(revaluation.closing_company_amount, Decimal('60.00'))
+        self.assertEqual(revaluation.revaluation, Decimal('-60.00'))
+        self.assertEqual(
+            [(r.amount, r.company_amount, r.closing_company_amount,
+                    r.revaluation) for r in revaluations[1:6]],
+            [(Decimal('44.00') * q, Decimal('22.00') * q,
+                    Decimal('11.00') * q, Decimal('-11.00') * q)
+                for q in range(1, 6)])
+        revaluation = revaluations[6]
+        self.assertEqual(revaluation.invoice, paid_invoice)
+        self.assertEqual(revaluation.invoice_currency_amount,
+            Decimal('200.00'))
+        self.assertEqual(revaluation.other_company_amount, Decimal('-50.00'))
+        self.assertEqual(revaluation.amount, paid_invoice.amount_to_pay)
+        self.assertEqual(revaluation.company_amount, Decimal('50.00'))
+        self.assertEqual(revaluation.closing_company_amount, Decimal('25.00'))
+        self.assertEqual(revaluation.revaluation, Decimal('-25.00'))